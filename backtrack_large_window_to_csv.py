@@ -1,10 +1,149 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 import csv
 import random
 import argparse
 import sys
 import os
 
+import numpy as np
+from numba import njit
+
+# 1970-01-01的日期序号，用于在"自1970年起的天数"和date之间换算
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_EPOCH_WEEKDAY = date(1970, 1, 1).weekday()  # 1970-01-01是周四
+
+@njit(cache=True, boundscheck=False)
+def _first_unpassed(ts, t, lo):
+    """
+    从下标lo开始二分查找第一个没有被时间点t越过的数据点
+    "越过"指数据点早于t且与t相差至少0.1秒；按时间排序后，被越过的数据点总是排在最前面
+    """
+    hi = ts.size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ts[mid] < t and abs(ts[mid] - t) >= 0.1:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@njit(cache=True, boundscheck=False)
+def _price_at(ts, px, a, t):
+    """
+    时间点t的价格，a为第一个没有被t越过的数据点下标(见_first_unpassed)
+    - 与t相差不到0.1秒的数据点中，取最早的一个(也就是数据点a)
+    - 否则取t之前的最后一个数据点；时间戳完全相同的几个点取价格最高的一个，
+      与按(时间戳, 价格)排序后取最后一个的结果一致
+    - 比最早的数据点还早，价格为0
+    """
+    if a < ts.size and abs(ts[a] - t) < 0.1:
+        return px[a]
+    if a == 0:
+        return 0.0
+    j = a - 1
+    price = px[j]
+    while j > 0 and ts[j - 1] == ts[a - 1]:
+        j -= 1
+        price = max(price, px[j])
+    return price
+
+
+@njit(cache=True, boundscheck=False)
+def _sma_backtrack(seg_hi, seg_len, ts, px, default_price):
+    """
+    累加若干段交易时间内每一秒的价格
+    两个数据点之间的价格保持不变，因此按数据点把每段切成若干区间，
+    用"价格 × 区间秒数"整体累加，不需要逐秒遍历
+    
+    参数:
+    - seg_hi: 每段最晚的时间点，段内的时间点从该时间点开始每次向前移动1秒
+    - seg_len: 每段包含的秒数
+    - ts, px: 按时间排序的数据点时间戳和价格
+    - default_price: 没有任何数据时使用的价格
+    
+    返回:
+    - (total, count): 价格大于0的时间点的价格总和与个数
+    """
+    total = 0.0
+    count = 0
+    for s in range(seg_hi.size):
+        n = seg_len[s]
+        if n <= 0:
+            continue
+        if ts.size == 0:
+            if default_price > 0:
+                total += default_price * n
+                count += n
+            continue
+        
+        # 段内时间点从早到晚为 first + k (k = 0..n-1)
+        first = seg_hi[s] - (n - 1)
+        a = _first_unpassed(ts, first, 0)
+        
+        k = 0
+        while k < n:
+            t = first + k
+            while a < ts.size and ts[a] < t and abs(ts[a] - t) >= 0.1:
+                a += 1
+            price = _price_at(ts, px, a, t)
+            
+            # 只有数据点a进入或离开0.1秒的误差范围时价格才可能变化，
+            # 在此之前留出1秒余量的区间内价格都等于当前价格，边界附近逐秒精确判断
+            if a < ts.size:
+                edge = ts[a] - first + (0.1 if abs(ts[a] - t) < 0.1 else -0.1)
+                nxt = min(max(int(np.ceil(edge)) - 1, k + 1), n)
+            else:
+                nxt = n
+            # 价格为0表示比最早的数据点还早，不计入
+            if price > 0:
+                total += price * (nxt - k)
+                count += nxt - k
+            k = nxt
+    return total, count
+
+
+@njit(cache=True, boundscheck=False)
+def _batch_find_prices(ts_q, ts_arr, px_arr, default_price):
+    """
+    批量查找每个时间点对应的价格，规则见_price_at
+    没有任何数据时使用默认价格
+    
+    参数:
+    - ts_q: 要查询的时间点数组
+    - ts_arr, px_arr: 按时间排序的数据点时间戳和价格
+    - default_price: 没有任何数据时使用的价格
+    """
+    out = np.empty(ts_q.size, np.float64)
+    for k in range(ts_q.size):
+        if ts_arr.size == 0:
+            out[k] = default_price
+            continue
+        out[k] = _price_at(ts_arr, px_arr, _first_unpassed(ts_arr, ts_q[k], 0), ts_q[k])
+    return out
+
+
+@lru_cache(maxsize=4096)
+def _trading_sessions(date_ordinal, morning_start, morning_end, afternoon_start, afternoon_end):
+    """
+    计算某个交易日的交易时段边界时间戳
+    结果按(日期序号, 交易时间)缓存，所有MovingAverage实例共享
+    
+    参数:
+    - date_ordinal: 日期序号(date.toordinal())
+    - morning_start, morning_end, afternoon_start, afternoon_end: 各交易时段边界的time对象
+    
+    返回:
+    - (上午开盘, 上午收盘, 下午开盘, 下午收盘) 时间戳
+    """
+    day = date.fromordinal(date_ordinal)
+    return tuple(
+        datetime.combine(day, t).timestamp()
+        for t in (morning_start, morning_end, afternoon_start, afternoon_end)
+    )
+
+
 class MovingAverage:
     def __init__(self, num_bin: int, window: float):
         """
@@ -16,9 +155,20 @@ class MovingAverage:
         """
         self.num_bin = num_bin  # 存储桶的数量
         self.window = window    # 窗口大小（秒）
-        self.data = []          # 存储(timestamp, value)对的列表
         self.current_timestamp = None
         
+        # 不等距采样时各部分保留的数据点数量
+        self._early_keep = max(1, int(num_bin * 0.1))  # 早期保留10%
+        self._mid_keep = max(1, int(num_bin * 0.3))    # 中期保留30%
+        self._recent_keep = num_bin - self._early_keep - self._mid_keep  # 近期保留60%
+        
+        # 按时间顺序存储的时间戳和价格数组，前_count个元素有效
+        # 采样后最多保留max(num_bin, 早期+中期保留数)个点，再留出一个位置给新到达的数据
+        capacity = max(num_bin, self._early_keep + self._mid_keep) + 1
+        self._ts = np.empty(capacity)
+        self._px = np.empty(capacity)
+        self._count = 0
+        
         # 交易时间设置
         self.trading_hours = {
             'morning_start': '09:30:00',
@@ -27,97 +177,141 @@ class MovingAverage:
             'afternoon_end': '15:00:00'
         }
         
+        # 交易时间只解析一次，之后直接与日期组合，不再重复解析字符串
+        self._morning_start_t, self._morning_end_t, self._afternoon_start_t, self._afternoon_end_t = (
+            datetime.strptime(self.trading_hours[key], "%H:%M:%S").time()
+            for key in ('morning_start', 'morning_end', 'afternoon_start', 'afternoon_end')
+        )
+        
+        # 交易时段边界在一天中的秒数，用于批量判断是否为交易时间
+        self._morning_start_sod, self._morning_end_sod, self._afternoon_start_sod, self._afternoon_end_sod = (
+            t.hour * 3600 + t.minute * 60 + t.second
+            for t in (self._morning_start_t, self._morning_end_t, self._afternoon_start_t, self._afternoon_end_t)
+        )
+        
+        # 按星期几(0是周一)查表判断是否为工作日
+        self._is_weekday = np.array([True] * 5 + [False] * 2)
+        
+        # 本地时区的UTC偏移(秒)，只用于由时间戳推算日期
+        # 交易时段离午夜足够远，夏令时带来的1小时误差不会使交易时段内的时间戳算错日期
+        self._tz_offset = int(datetime.now().astimezone().utcoffset().total_seconds())
+        
         # 用于记录日志的CSV文件
         self.log_file = None
         self.csv_writer = None
     
     def set_log_file(self, filename):
         """设置日志文件"""
-        self.log_file = open(filename, 'w', newline='')
+        self.log_file = open(filename, 'w', newline='', buffering=1 << 20)  # 使用1MB缓冲区，减少写文件的系统调用
         fieldnames = ['索引', '时间戳', '日期时间', '与当前时间的差距(秒)', '交易时段', '是否为交易时间', '价格', 'SMA', '点类型', '跨日/跨时段']
-        self.csv_writer = csv.DictWriter(self.log_file, fieldnames=fieldnames)
-        self.csv_writer.writeheader()
+        self.csv_writer = csv.writer(self.log_file)
+        self.csv_writer.writerow(fieldnames)
     
     def is_trading_time(self, timestamp):
         """检查给定时间戳是否在交易时间内"""
-        dt = datetime.fromtimestamp(timestamp)
-        date_str = dt.strftime('%Y-%m-%d')
+        # 用整数运算推算本地日期，不再构造datetime对象
+        day = int((timestamp + self._tz_offset) // 86400)
         
         # 检查是否是周末
-        if dt.weekday() >= 5:  # 5是周六，6是周日
+        if not self._is_weekday[(day + _EPOCH_WEEKDAY) % 7]:
             return False
             
         # 检查是否在交易时段内
-        morning_start = datetime.strptime(f"{date_str} {self.trading_hours['morning_start']}", "%Y-%m-%d %H:%M:%S")
-        morning_end = datetime.strptime(f"{date_str} {self.trading_hours['morning_end']}", "%Y-%m-%d %H:%M:%S")
-        afternoon_start = datetime.strptime(f"{date_str} {self.trading_hours['afternoon_start']}", "%Y-%m-%d %H:%M:%S")
-        afternoon_end = datetime.strptime(f"{date_str} {self.trading_hours['afternoon_end']}", "%Y-%m-%d %H:%M:%S")
-        
-        return (morning_start <= dt <= morning_end) or (afternoon_start <= dt <= afternoon_end)
-    
+        morning_start, morning_end, afternoon_start, afternoon_end = self._session_bounds(day + _EPOCH_ORDINAL)
+        return (morning_start <= timestamp <= morning_end) or (afternoon_start <= timestamp <= afternoon_end)
+
+    def _session_bounds(self, date_ordinal):
+        """返回指定日期(日期序号)的交易时段边界时间戳 (上午开盘, 上午收盘, 下午开盘, 下午收盘)"""
+        return _trading_sessions(date_ordinal, self._morning_start_t, self._morning_end_t,
+                                 self._afternoon_start_t, self._afternoon_end_t)
+
+    def _sessions_before(self, timestamp):
+        """
+        从给定时间戳所在的交易日开始，按时间倒序依次返回已经开盘的交易时段(start, end)
+        周末没有交易时段，会被直接跳过
+        """
+        day = datetime.fromtimestamp(timestamp).date()
+        while True:
+            if day.weekday() < 5:  # 5是周六，6是周日
+                morning_start, morning_end, afternoon_start, afternoon_end = self._session_bounds(day.toordinal())
+                for start, end in ((afternoon_start, afternoon_end), (morning_start, morning_end)):
+                    if start <= timestamp:
+                        yield start, end
+            day -= timedelta(days=1)
+
+    def _sessions_after(self, timestamp):
+        """
+        从给定时间戳所在的交易日开始，按时间顺序依次返回尚未收盘的交易时段(start, end)
+        周末没有交易时段，会被直接跳过
+        """
+        day = datetime.fromtimestamp(timestamp).date()
+        while True:
+            if day.weekday() < 5:  # 5是周六，6是周日
+                morning_start, morning_end, afternoon_start, afternoon_end = self._session_bounds(day.toordinal())
+                for start, end in ((morning_start, morning_end), (afternoon_start, afternoon_end)):
+                    if end >= timestamp:
+                        yield start, end
+            day += timedelta(days=1)
+
     def Update(self, timestamp: float, value: float):
         """
         新数据到达，更新状态
+        数据必须按时间顺序到达：_ts始终按时间从早到晚排列，取舍时也按下标顺序保留，
+        价格查找和SMA计算中的二分查找都依赖这一点
+        允许时间戳相同(或相差不到0.1秒)的数据点，查找价格时取其中最早保存的一个
         
         参数:
         - timestamp: (float) 时间戳
         - value: (float) 股票价格
         """
+        assert not self._count or timestamp >= self._ts[self._count - 1], "数据必须按时间顺序到达"
+        
         # 更新当前时间戳
         self.current_timestamp = timestamp
         
-        # 添加新数据
-        self.data.append((timestamp, value))
+        # 添加新数据，写入预先分配好的数组
+        self._ts[self._count] = timestamp
+        self._px[self._count] = value
+        self._count += 1
         
         # 如果数据量超过num_bin，需要进行取舍
-        if len(self.data) > self.num_bin:
+        if self._count > self.num_bin:
             # 采用不等距采样策略：近期数据保留更多，早期数据保留更少
-            data_length = len(self.data)
-            
-            # 对数据进行时间排序
-            sorted_data = sorted(self.data, key=lambda x: x[0])
+            # 数据按到达顺序存储，本身已按时间排序；各部分的采样下标依次递增，压缩后仍然有序
+            data_length = self._count
             
             # 将数据分为三个部分：早期(20%)、中期(30%)、近期(50%)
             early_end = int(data_length * 0.2)
             mid_end = int(data_length * 0.5)
             
-            # 计算每部分应保留的数据点数量
-            early_keep = max(1, int(self.num_bin * 0.1))  # 早期保留10%
-            mid_keep = max(1, int(self.num_bin * 0.3))    # 中期保留30%
-            recent_keep = self.num_bin - early_keep - mid_keep  # 近期保留60%
-            
-            # 对各部分进行采样
-            # 早期数据采样（稀疏）
-            early_data = sorted_data[:early_end]
-            if early_data:
-                early_indices = [i * len(early_data) // early_keep for i in range(early_keep)]
-                early_sampled = [early_data[i] for i in early_indices]
-            else:
-                early_sampled = []
-            
-            # 中期数据采样（中等密度）
-            mid_data = sorted_data[early_end:mid_end]
-            if mid_data:
-                mid_indices = [i * len(mid_data) // mid_keep for i in range(mid_keep)]
-                mid_sampled = [mid_data[i] for i in mid_indices]
-            else:
-                mid_sampled = []
-            
-            # 近期数据采样（密集）
-            recent_data = sorted_data[mid_end:]
-            if recent_data:
-                recent_indices = [i * len(recent_data) // recent_keep for i in range(recent_keep)]
-                recent_sampled = [recent_data[i] for i in recent_indices]
-            else:
-                recent_sampled = []
-            
-            # 组合采样结果
-            self.data = early_sampled + mid_sampled + recent_sampled
+            # 对各部分进行等间距采样：早期稀疏、中期中等密度、近期密集
+            indices = np.concatenate([
+                self._sample_indices(0, early_end, self._early_keep),
+                self._sample_indices(early_end, mid_end, self._mid_keep),
+                self._sample_indices(mid_end, data_length, self._recent_keep),
+            ])
             
             # 确保最新的数据点一定被保留
-            if sorted_data and sorted_data[-1] not in self.data:
-                # 替换倒数第二个点为最新点
-                self.data[-1] = sorted_data[-1]
+            if indices[-1] != data_length - 1:
+                # 替换最后一个采样点为最新点
+                indices[-1] = data_length - 1
+            
+            # 按采样下标压缩数组
+            self._count = len(indices)
+            self._ts[:self._count] = self._ts[indices]
+            self._px[:self._count] = self._px[indices]
+    
+    @staticmethod
+    def _sample_indices(start, end, keep):
+        """在[start, end)范围内等间距地选取keep个下标"""
+        length = end - start
+        if length <= 0 or keep <= 0:
+            return np.empty(0, dtype=np.intp)
+        return start + np.arange(keep) * length // keep
+    
+    def _view(self):
+        """返回当前有效的时间戳和价格数组视图(按时间从早到晚排列)"""
+        return self._ts[:self._count], self._px[:self._count]
     
     def Get(self) -> float:
         """
@@ -131,7 +325,7 @@ class MovingAverage:
     def GetSMA(self) -> float:
         """
         计算当前回溯窗口的简单移动平均线(SMA)
-        使用O(1)的空间复杂度实现
+        使用O(1)的空间复杂度实现，设置了日志文件时同时记录窗口内每个时间点的明细
         
         返回:
         - float: SMA值
@@ -139,291 +333,179 @@ class MovingAverage:
         if not self.current_timestamp:
             return 0.0
         
-        # 回溯窗口的起始时间
-        window_start = self.current_timestamp - self.window
-        
-        # 用于累计SMA计算的变量
-        total_price = 0.0
-        valid_points_count = 0
+        sma, segments = self._compute_sma()
         
-        # 当前正在检查的时间点，从当前时间开始往回推
-        check_time = self.current_timestamp
-        
-        # 获取当前价格，如果data为空则使用默认价格100.0
-        current_price = self.data[-1][1] if self.data else 100.0
-        
-        # 获取原始数据点的时间戳(仅用于日志)
-        original_timestamps = [ts for ts, _ in self.data]
-        
-        # 记录不同交易时段和日期的数据点(仅用于日志)
-        current_dt = datetime.fromtimestamp(self.current_timestamp)
-        current_date = current_dt.date()
-        current_session = "morning" if current_dt.hour < 12 else "afternoon"
-        
-        # 记录发现的时段和日期(仅用于日志)
-        found_sessions = {current_session}
-        found_dates = {current_date}
+        # 记录到CSV (仅当需要时)
+        if self.csv_writer:
+            self._log_window(segments, sma)
         
-        # 记录跨时段和跨日标志(仅用于日志)
-        is_cross_session = False
-        is_cross_day = False
+        return sma
+    
+    def _compute_sma(self):
+        """
+        计算当前回溯窗口的SMA，只做数值计算，不涉及日志
         
-        # 记录窗口内的时间戳(仅用于CSV日志)
-        timestamps_for_log = []
+        返回:
+        - (sma, segments): SMA值，以及参与计算的各组时间段(seg_hi, seg_len)
+        """
+        # 回溯窗口的起始时间
+        window_start = self.current_timestamp - self.window
         
-        # 检查是否在下午交易时段，如果是，需要特殊处理
-        is_afternoon_session = current_session == "afternoon"
+        # 获取当前价格，如果没有数据则使用默认价格100.0
+        current_price = float(self._px[self._count - 1]) if self._count else 100.0
         
-        # 如果当前时间点是下午交易时段开始后不久的时间（例如，下午开盘后300秒内）
-        # 需要确保回溯能够正确处理跨时段情况
-        if is_afternoon_session:
-            afternoon_start = datetime.strptime(f"{current_date.strftime('%Y-%m-%d')} {self.trading_hours['afternoon_start']}", "%Y-%m-%d %H:%M:%S")
-            # 计算当前时间与下午开盘时间的差值（秒）
-            seconds_since_afternoon_open = (current_dt - afternoon_start).total_seconds()
-            
-            # 如果当前时间是下午开盘后且回溯窗口超过了下午已交易的时间
-            # 需要确保能够回溯到上午交易时段
-            if seconds_since_afternoon_open < self.window:
-                # 标记为跨时段
-                is_cross_session = True
-                found_sessions.add("morning")
-        
-        # 回溯到窗口起始时间
-        while check_time >= window_start and check_time >= 0:
-            # 只有在交易时间内的点才计入窗口
-            if self.is_trading_time(check_time):
-                # 检查当前时间点的日期和时段
-                check_dt = datetime.fromtimestamp(check_time)
-                check_date = check_dt.date()
-                check_session = "morning" if check_dt.hour < 12 else "afternoon"
-                
-                # 更新发现的时段和日期集合
-                found_sessions.add(check_session)
-                found_dates.add(check_date)
-                
-                # 更新跨时段和跨日标志
-                is_cross_session = len(found_sessions) > 1
-                is_cross_day = len(found_dates) > 1
-                
-                # 为当前检查的时间点找到一个价格
-                price_at_time = self._find_price_at_time(check_time, current_price)
-                
-                # 如果价格大于0，累加到总价中用于计算SMA
-                if price_at_time > 0:
-                    total_price += price_at_time
-                    valid_points_count += 1
-                
-                # 记录时间戳用于日志(仅用于CSV日志)
-                if self.csv_writer:
-                    timestamps_for_log.append(check_time)
-            
-            # 向前移动1秒
-            check_time -= 1
-            
-            # 如果进入了非交易时间，需要跳过到前一个交易时段的结束时间
-            if not self.is_trading_time(check_time) and check_time > 0:
-                check_dt = datetime.fromtimestamp(check_time)
-                check_date = check_dt.strftime('%Y-%m-%d')
-                check_hour = check_dt.hour
-                check_minute = check_dt.minute
-                
-                # 找到要跳转到的时间点
-                jump_to_time = None
-                
-                # 如果在中午休市时间
-                if 11 <= check_hour < 13:
-                    # 跳转到上午收盘时间
-                    morning_end = datetime.strptime(f"{check_date} {self.trading_hours['morning_end']}", "%Y-%m-%d %H:%M:%S")
-                    jump_to_time = morning_end.timestamp()
-                    
-                    # 更新时段信息
-                    found_sessions.add("morning")
-                    is_cross_session = True
-                # 如果在凌晨或夜间（跨日）
-                elif check_hour < 9 or check_hour >= 15:
-                    # 找到前一交易日
-                    check_day = datetime.strptime(check_date, "%Y-%m-%d").date()
-                    prev_day = check_day - timedelta(days=1)
-                    
-                    # 跳过周末
-                    while prev_day.weekday() >= 5:  # 5是周六，6是周日
-                        prev_day -= timedelta(days=1)
-                    
-                    # 跳转到前一交易日的收盘时间
-                    prev_date_str = prev_day.strftime('%Y-%m-%d')
-                    afternoon_end = datetime.strptime(f"{prev_date_str} {self.trading_hours['afternoon_end']}", "%Y-%m-%d %H:%M:%S")
-                    jump_to_time = afternoon_end.timestamp()
-                    
-                    # 更新日期和时段信息
-                    found_dates.add(prev_day)
-                    found_sessions.add("afternoon")
-                    is_cross_day = True
-                    is_cross_session = True
-                
-                # 执行跳转
-                if jump_to_time is not None and jump_to_time < check_time:
-                    check_time = jump_to_time
+        # 按交易时段划分回溯窗口，累加窗口内每个交易秒的价格
+        ts, px = self._view()
+        segments = [self._window_segments(window_start)]
+        total_price, valid_points_count = _sma_backtrack(*segments[0], ts, px, current_price)
         
         # 特殊处理下午开盘后回溯的情况
         # 如果当前是下午交易时段，且回溯窗口尚未完成，需要继续回溯至上午收盘
-        if is_afternoon_session and valid_points_count < self.window:
+        current_dt = datetime.fromtimestamp(self.current_timestamp)
+        if current_dt.hour >= 12 and valid_points_count < self.window:
             # 找到当天上午收盘时间
-            morning_end = datetime.strptime(f"{current_date.strftime('%Y-%m-%d')} {self.trading_hours['morning_end']}", "%Y-%m-%d %H:%M:%S")
-            morning_end_ts = morning_end.timestamp()
-            
-            # 从上午收盘时间开始继续回溯
-            check_time = morning_end_ts
-            
-            # 更新时段信息
-            found_sessions.add("morning")
-            is_cross_session = True
+            morning_end_ts = self._session_bounds(current_dt.toordinal())[1]
             
             # 计算还需要回溯的交易秒数
-            remaining_seconds = self.window - valid_points_count
+            remaining_seconds = int(np.ceil(self.window - valid_points_count))
             
-            # 继续回溯收集上午时段的数据
-            while check_time >= 0 and remaining_seconds > 0:
-                if self.is_trading_time(check_time):
-                    # 为上午时段的时间点找到价格
-                    price_at_morning = self._find_price_at_time(check_time, current_price)
-                    
-                    # 如果价格大于0，累加到总价中用于计算SMA
-                    if price_at_morning > 0:
-                        total_price += price_at_morning
-                        valid_points_count += 1
-                    
-                    # 记录时间戳用于日志(仅用于CSV日志)
-                    if self.csv_writer:
-                        timestamps_for_log.append(check_time)
-                        
-                    remaining_seconds -= 1
-                
-                # 向前移动1秒
-                check_time -= 1
-                
-                # 如果离开交易时间，需要处理跳转
-                if not self.is_trading_time(check_time) and check_time > 0:
-                    check_dt = datetime.fromtimestamp(check_time)
-                    check_date = check_dt.strftime('%Y-%m-%d')
-                    check_hour = check_dt.hour
-                    
-                    # 如果到达非交易时间，需要跳转
-                    jump_to_time = None
-                    
-                    # 如果到达前一天，跳转到前一交易日收盘
-                    if check_hour < 9 or check_hour >= 15:
-                        # 找到前一交易日
-                        check_day = datetime.strptime(check_date, "%Y-%m-%d").date()
-                        prev_day = check_day - timedelta(days=1)
-                        
-                        # 跳过周末
-                        while prev_day.weekday() >= 5:
-                            prev_day -= timedelta(days=1)
-                        
-                        # 跳转到前一交易日的收盘时间
-                        prev_date_str = prev_day.strftime('%Y-%m-%d')
-                        afternoon_end = datetime.strptime(f"{prev_date_str} {self.trading_hours['afternoon_end']}", "%Y-%m-%d %H:%M:%S")
-                        jump_to_time = afternoon_end.timestamp()
-                        
-                        # 更新标志
-                        found_dates.add(prev_day)
-                        found_sessions.add("afternoon")
-                        is_cross_day = True
-                        is_cross_session = True
-                    
-                    # 执行跳转
-                    if jump_to_time is not None and jump_to_time < check_time:
-                        check_time = jump_to_time
+            # 从上午收盘时间开始按交易时段继续回溯，直到补足所需的交易秒数
+            segments.append(self._backfill_segments(morning_end_ts, remaining_seconds))
+            morning_total, morning_count = _sma_backtrack(*segments[-1], ts, px, current_price)
+            total_price += morning_total
+            valid_points_count += morning_count
         
         # 计算SMA
         sma = total_price / valid_points_count if valid_points_count > 0 else 0.0
-        
-        # 记录到CSV (仅当需要时)
-        if self.csv_writer and timestamps_for_log:
-            # 构建所需的窗口数据格式用于日志记录
-            window_data_for_log = []
-            for ts in timestamps_for_log:
-                price = self._find_price_at_time(ts, current_price)
-                is_original = abs(ts - min(original_timestamps, key=lambda x: abs(x - ts))) < 0.1 if original_timestamps else False
-                window_data_for_log.append((ts, price, is_original))
-            self.log_to_csv(window_data_for_log, sma)
-        
-        return sma
+        return sma, segments
     
-    # def calculate_sma(self, data_points):
-    #     """
-    #     计算简单移动平均线(SMA)
-    #     只考虑原始数据点，且忽略价格为0的数据点（这些点代表已越过数据开始日期）
-        
-    #     参数:
-    #     - data_points: 包含(timestamp, price)元组的列表，仅包含原始数据点
-        
-    #     返回:
-    #     - SMA值
-    #     """
-    #     if not data_points:
-    #         return 0.0
-        
-    #     # 过滤掉价格为0的数据点
-    #     valid_data_points = [(ts, price) for ts, price in data_points if price > 0]
-        
-    #     if not valid_data_points:
-    #         return 0.0
-        
-    #     # 计算所有非零价格的算术平均值
-    #     total_price = sum(price for _, price in valid_data_points)
-    #     count = len(valid_data_points)
+    def _log_window(self, segments, sma):
+        """把参与计算的每个交易秒及其价格记录到CSV"""
+        log_timestamps = np.concatenate([self._segment_seconds(seg_hi, seg_len) for seg_hi, seg_len in segments])
+        if not len(log_timestamps):
+            return
         
-    #     if count == 0:
-    #         return 0.0
-            
-    #     return total_price / count
+        # 一次性查出所有时间点的价格，并标记哪些时间点是原始数据点
+        log_prices = self._find_prices_at_times(log_timestamps)
+        is_original = self._is_original(log_timestamps)
+        self.log_to_csv(log_timestamps, log_prices, is_original, sma)
     
-    def _find_price_at_time(self, timestamp, default_price=100.0):
+    def _window_segments(self, window_start):
         """
-        找到指定时间戳对应的价格
-        如果找不到精确匹配，则使用最近的价格或默认价格
-        核心原则：两条数据之间的所有时间点上，价格都等于第一条数据的价格
-        边界条件：如果回溯窗口内的点比最早的数据点还早，价格为0
-        """
-        if not self.data:
-            return default_price
-        
-        # 先查找精确匹配
-        for ts, price in self.data:
-            if abs(ts - timestamp) < 0.1:  # 允许0.1秒的误差
-                return price
+        按交易时段把[window_start, 当前时间]内的交易秒划分成若干段
+        当前所在时段以当前时间戳为基准逐秒回溯，更早的时段从收盘时间开始逐秒回溯
         
-        # 找不到精确匹配，查找前一个时间点
-        # 寻找最近的但时间小于当前时间点的数据
-        prev_ts = None
-        prev_price = None
-        
-        # 获取所有数据点并按时间排序
-        sorted_data = sorted(self.data)
+        返回:
+        - (seg_hi, seg_len): 每段最晚的时间点和该段包含的秒数，按时间倒序排列
+        """
+        current = self.current_timestamp
+        sessions = self._sessions_before(current)
         
-        # 如果当前时间点比最早的数据点还早，返回0
-        if sorted_data and timestamp < sorted_data[0][0]:
-            return 0.0
+        # 与原始的逐秒回溯保持一致：收盘1秒以后直接跳到前一交易日的收盘时间，当天的交易时段不计入窗口
+        morning_start, _, _, afternoon_end = self._session_bounds(datetime.fromtimestamp(current).toordinal())
+        if current > afternoon_end + 1:
+            sessions = self._sessions_before(morning_start - 1)
         
-        for ts, price in sorted_data:
-            if ts > timestamp:
-                # 如果已经超过当前时间点，结束查找
+        seg_hi, seg_len = [], []
+        for start, end in sessions:
+            if end < window_start:
                 break
-            # 更新前一个时间点和价格
-            prev_ts = ts
-            prev_price = price
+            if start <= current <= end + 1:
+                # 当前所在时段(包括收盘后不到1秒)：以当前时间戳为基准逐秒回溯，
+                # 当前时间已收盘时从前一秒开始
+                hi = current if current <= end else current - 1
+                lower = max(start, window_start)
+                length = int(np.ceil(hi - lower)) + 1
+                if hi - (length - 1) < lower:
+                    length -= 1
+                length = max(length, 0)
+            else:
+                hi = end
+                lower = max(start, np.ceil(window_start))
+                length = int(end - lower) + 1
+            seg_hi.append(hi)
+            seg_len.append(length)
+        return np.array(seg_hi, dtype=np.float64), np.array(seg_len, dtype=np.int64)
+    
+    def _backfill_segments(self, timestamp, seconds):
+        """从timestamp开始按交易时段逐秒向前回溯seconds个交易秒，返回格式与_window_segments相同"""
+        seg_hi, seg_len = [], []
+        for start, end in self._sessions_before(timestamp):
+            if seconds <= 0:
+                break
+            length = min(int(end - start) + 1, seconds)
+            seg_hi.append(end)
+            seg_len.append(length)
+            seconds -= length
+        return np.array(seg_hi, dtype=np.float64), np.array(seg_len, dtype=np.int64)
+    
+    @staticmethod
+    def _segment_seconds(seg_hi, seg_len):
+        """把时间段展开为逐秒倒序的时间点数组"""
+        if not len(seg_hi):
+            return np.empty(0)
+        return np.concatenate([hi - np.arange(length) for hi, length in zip(seg_hi, seg_len)])
+    
+    def _find_prices_at_times(self, timestamps, default_price=100.0):
+        """
+        批量查找多个时间戳对应的价格
+        与时间戳相差不到0.1秒的数据点中取最早的一个，否则取之前的最后一个数据点，
+        比最早的数据点还早的时间点价格为0(详见_price_at)
         
-        # 如果找到了前一个时间点，使用该价格
-        if prev_ts is not None:
-            return prev_price
+        参数:
+        - timestamps: 时间戳数组
+        - default_price: 没有任何数据时使用的默认价格
         
-        # 如果没有找到前一个时间点，说明当前时间点比所有数据都早
-        # 根据边界条件，返回0
-        return 0.0
+        返回:
+        - np.ndarray: 每个时间戳对应的价格
+        """
+        ts, px = self._view()
+        return _batch_find_prices(np.asarray(timestamps, dtype=np.float64), ts, px, default_price)
     
-    def log_to_csv(self, timestamps_with_prices, sma=0.0):
-        """将时间戳、价格和SMA记录到CSV文件"""
+    @staticmethod
+    def _local_seconds(timestamps):
+        """
+        把时间戳数组换算为本地时间下自1970-01-01 00:00:00起的秒数
+        UTC偏移每15分钟查询一次，能够正确处理夏令时切换
+        """
+        quarters, inverse = np.unique(np.floor(timestamps / 900), return_inverse=True)
+        offsets = np.array([datetime.fromtimestamp(q * 900, timezone.utc).astimezone().utcoffset().total_seconds()
+                            for q in quarters.tolist()])
+        return timestamps + offsets[inverse]
+    
+    def _vector_is_trading(self, timestamps):
+        """批量检查时间戳数组是否在交易时间内"""
+        # 换算为本地日期和一天中的秒数，用整数边界比较并查表排除周末
+        local = self._local_seconds(timestamps)
+        days = np.floor(local / 86400)
+        sod = local - days * 86400
+        is_weekday = self._is_weekday[(days.astype(np.int64) + _EPOCH_WEEKDAY) % 7]
+        return is_weekday & (((self._morning_start_sod <= sod) & (sod <= self._morning_end_sod)) |
+                             ((self._afternoon_start_sod <= sod) & (sod <= self._afternoon_end_sod)))
+    
+    def _is_original(self, timestamps):
+        """批量检查时间戳是否为原始数据点：与最近的数据点相差不到0.1秒"""
+        ts, _ = self._view()
+        if not len(ts):
+            return np.zeros(len(timestamps), dtype=bool)
+        
+        # 二分查找插入位置，最近的数据点只可能是左右两个相邻点之一
+        idx = np.searchsorted(ts, timestamps)
+        left = ts[(idx - 1).clip(0)]
+        right = ts[idx.clip(max=len(ts) - 1)]
+        nearest = np.minimum(np.abs(timestamps - left), np.abs(timestamps - right))
+        return nearest < 0.1
+    
+    def log_to_csv(self, timestamps, prices, is_original, sma=0.0):
+        """
+        将时间戳、价格和SMA记录到CSV文件
+        
+        参数:
+        - timestamps: 窗口内各时间点的时间戳数组
+        - prices: 各时间点对应的价格数组
+        - is_original: 各时间点是否为原始数据点的布尔数组
+        - sma: 当前窗口的SMA值
+        """
         if not self.csv_writer:
             return
             
@@ -431,58 +513,66 @@ class MovingAverage:
         current_dt = datetime.fromtimestamp(self.current_timestamp)
         current_date = current_dt.date()
         
-        # 获取所有时间戳的日期，用于检测跨日情况
-        dates_in_window = set()
-        for ts, _, _ in timestamps_with_prices:
-            dates_in_window.add(datetime.fromtimestamp(ts).date())
-        is_cross_day = len(dates_in_window) > 1
+        # 批量换算所有时间戳的本地日期、时段、格式化字符串和是否为交易时间
+        # 与datetime.fromtimestamp一致，先舍入到微秒再截断到秒
+        local_seconds = np.floor(np.round(self._local_seconds(timestamps), 6)).astype(np.int64)
+        date_strs = np.char.replace(np.datetime_as_string(local_seconds.astype('datetime64[s]')), 'T', ' ')
+        days = local_seconds // 86400
+        is_morning = local_seconds % 86400 < 12 * 3600
+        trading_mask = self._vector_is_trading(timestamps)
+        
+        # 检测是否跨日
+        is_cross_day = len(np.unique(days)) > 1
+        current_day = current_date.toordinal() - _EPOCH_ORDINAL
         
         # 检测是否跨时段（上午/下午）
-        morning_timestamps = 0
-        afternoon_timestamps = 0
-        for ts, _, _ in timestamps_with_prices:
-            dt = datetime.fromtimestamp(ts)
-            if dt.hour < 12:
-                morning_timestamps += 1
-            else:
-                afternoon_timestamps += 1
+        morning_timestamps = int(is_morning.sum())
+        afternoon_timestamps = len(timestamps) - morning_timestamps
         is_cross_session = morning_timestamps > 0 and afternoon_timestamps > 0
         
-        # 写入每个时间点的数据
-        for i, (ts, price, is_original) in enumerate(timestamps_with_prices):
-            dt = datetime.fromtimestamp(ts)
+        # 构建每个时间点的数据，最后一次性写入
+        rows = []
+        for i, (ts, price, original, date_str, day, morning, trading) in enumerate(
+                zip(timestamps.tolist(), prices.tolist(), is_original.tolist(), date_strs.tolist(),
+                    days.tolist(), is_morning.tolist(), trading_mask.tolist())):
             time_diff = self.current_timestamp - ts  # 与当前时间的差距（秒）
-            session = "上午" if dt.hour < 12 else "下午"
-            is_trading = "是" if self.is_trading_time(ts) else "否"
+            session = "上午" if morning else "下午"
+            is_trading = "是" if trading else "否"
             
             # 所有有效数据点都显示相同的SMA值（无论是原始还是补充点）
             display_sma = sma if price > 0 else 0.0
             
             # 添加是否为原始数据点的标记
-            point_type = "原始数据点" if is_original else "补充点"
+            point_type = "原始数据点" if original else "补充点"
             
             # 添加跨日和跨时段标记
             cross_info = []
-            if is_cross_day and dt.date() != current_date:
+            if is_cross_day and day != current_day:
                 cross_info.append("跨日")
             if is_cross_session and ((session == "上午" and afternoon_timestamps > 0) or (session == "下午" and morning_timestamps > 0)):
                 cross_info.append("跨时段")
             cross_status = "、".join(cross_info) if cross_info else "同日同时段"
             
-            self.csv_writer.writerow({
-                '索引': i+1,
-                '时间戳': ts,
-                '日期时间': dt.strftime('%Y-%m-%d %H:%M:%S'),
-                '与当前时间的差距(秒)': round(time_diff, 1),
-                '交易时段': session,
-                '是否为交易时间': is_trading,
-                '价格': round(price, 2),
-                'SMA': round(display_sma, 2),
-                '点类型': point_type,
-                '跨日/跨时段': cross_status
-            })
-        
-        self.log_file.flush()  # 确保数据写入文件
+            # 各列顺序与set_log_file中的表头一致
+            rows.append((
+                i+1,                    # 索引
+                ts,                     # 时间戳
+                date_str,               # 日期时间
+                round(time_diff, 1),    # 与当前时间的差距(秒)
+                session,                # 交易时段
+                is_trading,             # 是否为交易时间
+                round(price, 2),        # 价格
+                round(display_sma, 2),  # SMA
+                point_type,             # 点类型
+                cross_status            # 跨日/跨时段
+            ))
+        
+        self.csv_writer.writerows(rows)
+    
+    def flush_log(self):
+        """把缓冲区中的日志数据写入文件"""
+        if self.log_file:
+            self.log_file.flush()
     
     def close_log_file(self):
         """关闭日志文件"""
@@ -577,27 +667,14 @@ def generate_test_data(start_timestamp, num_points):
     # 使用固定的随机种子以获得可重复的结果
     random.seed(42)
     
-    # 如果给定的起始时间戳不是交易时间，则调整到下一个交易时间
+    # 按时间顺序逐个取出交易时段，代替对每个数据点判断是否为交易时间
     ma = MovingAverage(10, 60)
-    if not ma.is_trading_time(start_timestamp):
-        current_dt = datetime.fromtimestamp(start_timestamp)
-        current_date = current_dt.date()
-        
-        # 如果当前时间在上午交易时段前，则调整到当天上午开盘时间
-        if current_dt.hour < 9 or (current_dt.hour == 9 and current_dt.minute < 30):
-            next_trading_time = datetime.strptime(f"{current_date.strftime('%Y-%m-%d')} 09:30:00", "%Y-%m-%d %H:%M:%S")
-        # 如果当前时间在上午交易时段结束后，下午交易时段前，则调整到当天下午开盘时间
-        elif (current_dt.hour == 11 and current_dt.minute >= 30) or (current_dt.hour == 12):
-            next_trading_time = datetime.strptime(f"{current_date.strftime('%Y-%m-%d')} 13:00:00", "%Y-%m-%d %H:%M:%S")
-        # 如果当前时间在当天交易时段结束后，则调整到下一个交易日的上午开盘时间
-        else:
-            next_day = current_date + timedelta(days=1)
-            # 如果下一天是周末，则调整到下周一
-            while next_day.weekday() >= 5:  # 5是周六，6是周日
-                next_day += timedelta(days=1)
-            next_trading_time = datetime.strptime(f"{next_day.strftime('%Y-%m-%d')} 09:30:00", "%Y-%m-%d %H:%M:%S")
-        
-        start_timestamp = next_trading_time.timestamp()
+    sessions = ma._sessions_after(start_timestamp)
+    session_start, session_end = next(sessions)
+    
+    # 如果给定的起始时间戳不是交易时间，则调整到下一个交易时段的开盘时间
+    if start_timestamp < session_start:
+        start_timestamp = session_start
         print(f"已调整起始时间为: {datetime.fromtimestamp(start_timestamp).strftime('%Y-%m-%d %H:%M:%S')}")
     
     data = []
@@ -617,27 +694,11 @@ def generate_test_data(start_timestamp, num_points):
         time_increment = random.randint(30, 600)
         current_timestamp += time_increment
         
-        # 检查当前时间戳是否在交易时间内，如果不在则调整
-        if not ma.is_trading_time(current_timestamp):
-            current_dt = datetime.fromtimestamp(current_timestamp)
-            current_date = current_dt.date()
-            current_hour = current_dt.hour
-            current_minute = current_dt.minute
-            
-            # 如果在中午休市时间，跳到下午开盘
-            if current_hour == 11 and current_minute >= 30 or current_hour == 12:
-                afternoon_start = datetime.strptime(f"{current_date.strftime('%Y-%m-%d')} 13:00:00", "%Y-%m-%d %H:%M:%S")
-                current_timestamp = afternoon_start.timestamp()
-            # 如果在收盘后或开盘前，跳到下一个交易日
-            elif current_hour >= 15 or current_hour < 9 or (current_hour == 9 and current_minute < 30):
-                # 获取下一个交易日
-                next_day = current_date + timedelta(days=1)
-                # 跳过周末
-                while next_day.weekday() >= 5:
-                    next_day += timedelta(days=1)
-                
-                next_trading_time = datetime.strptime(f"{next_day.strftime('%Y-%m-%d')} 09:30:00", "%Y-%m-%d %H:%M:%S")
-                current_timestamp = next_trading_time.timestamp()
+        # 如果超过了当前交易时段的收盘时间(中午休市或收盘后)，跳到下一个交易时段的开盘时间
+        while current_timestamp > session_end:
+            session_start, session_end = next(sessions)
+        if current_timestamp < session_start:
+            current_timestamp = session_start
         
         # 生成价格变动 (-1% 到 1%)
         price_change_percent = random.uniform(-1.0, 1.0)
@@ -657,8 +718,36 @@ def generate_test_data(start_timestamp, num_points):
 
 def main():
     """主函数"""
-    # 获取用户输入
-    num_bin, window, start_timestamp, num_points, output_file = get_user_input()
+    parser = argparse.ArgumentParser(description="移动平均和回溯窗口测试程序")
+    parser.add_argument('--batch', action='store_true',
+                        help="批处理模式：不交互询问参数，处理数据时也不暂停")
+    parser.add_argument('--num-bin', type=int, default=10, help="桶的数量 (仅批处理模式，默认为10)")
+    parser.add_argument('--window', type=int, default=1000, help="时间窗口大小(秒) (仅批处理模式，默认为1000)")
+    parser.add_argument('--start', default="2025-04-04 09:30:00",
+                        help="起始时间 YYYY-MM-DD HH:MM:SS (仅批处理模式，默认为2025-04-04 09:30:00)")
+    parser.add_argument('--num-points', type=int, default=20, help="要生成的数据点数量 (仅批处理模式，默认为20)")
+    parser.add_argument('--output', default="output.csv", help="输出文件路径 (仅批处理模式，默认为output.csv)")
+    args = parser.parse_args()
+    
+    if args.batch:
+        # 批处理模式直接使用命令行参数，校验规则与get_user_input相同
+        if args.num_bin <= 0:
+            parser.error("桶的数量必须大于0")
+        if args.window <= 0:
+            parser.error("时间窗口必须大于0")
+        if args.num_points <= 0:
+            parser.error("数据点数量必须大于0")
+        try:
+            start_dt = datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S")
+        except ValueError as e:
+            parser.error(f"无效的日期或时间格式: {e}")
+        if start_dt.weekday() >= 5:  # 5是周六，6是周日
+            parser.error(f"{start_dt.date()}是周末，不是交易日")
+        num_bin, window, start_timestamp = args.num_bin, args.window, start_dt.timestamp()
+        num_points, output_file = args.num_points, args.output
+    else:
+        # 获取用户输入
+        num_bin, window, start_timestamp, num_points, output_file = get_user_input()
     
     # 创建MovingAverage实例
     ma = MovingAverage(num_bin, window)
@@ -668,34 +757,28 @@ def main():
         dt = datetime.fromtimestamp(start_timestamp)
         print(f"错误：起始时间 {dt.strftime('%Y-%m-%d %H:%M:%S')} 不在交易时间内")
         
-        # 询问是否要调整到最近的交易时间
-        adjust = input("是否要调整到最近的交易时间? (y/n): ").strip().lower()
+        # 询问是否要调整到最近的交易时间，批处理模式下直接调整
+        adjust = 'y' if args.batch else input("是否要调整到最近的交易时间? (y/n): ").strip().lower()
         if adjust != 'y':
             return
         
         # 调整到最近的交易时间
         dt = datetime.fromtimestamp(start_timestamp)
-        date_str = dt.strftime('%Y-%m-%d')
         
         # 检查是否可以调整到当天的交易时间
-        morning_start = datetime.strptime(f"{date_str} {ma.trading_hours['morning_start']}", "%Y-%m-%d %H:%M:%S")
-        morning_end = datetime.strptime(f"{date_str} {ma.trading_hours['morning_end']}", "%Y-%m-%d %H:%M:%S")
-        afternoon_start = datetime.strptime(f"{date_str} {ma.trading_hours['afternoon_start']}", "%Y-%m-%d %H:%M:%S")
-        afternoon_end = datetime.strptime(f"{date_str} {ma.trading_hours['afternoon_end']}", "%Y-%m-%d %H:%M:%S")
-        
         dt_time = dt.time()
-        morning_start_time = morning_start.time()
-        morning_end_time = morning_end.time()
-        afternoon_start_time = afternoon_start.time()
-        afternoon_end_time = afternoon_end.time()
+        morning_start_time = ma._morning_start_t
+        morning_end_time = ma._morning_end_t
+        afternoon_start_time = ma._afternoon_start_t
+        afternoon_end_time = ma._afternoon_end_t
         
         # 找到最近的交易时间
         if dt_time < morning_start_time:
             # 如果在上午开盘前，调整到上午开盘时间
-            adjusted_dt = morning_start
+            adjusted_dt = datetime.combine(dt.date(), morning_start_time)
         elif morning_end_time < dt_time < afternoon_start_time:
             # 如果在中午休市时间，调整到下午开盘时间
-            adjusted_dt = afternoon_start
+            adjusted_dt = datetime.combine(dt.date(), afternoon_start_time)
         elif dt_time > afternoon_end_time:
             # 如果在收盘后，调整到下一个交易日的上午开盘时间
             next_day = dt.date() + timedelta(days=1)
@@ -720,10 +803,11 @@ def main():
     print(f"\n开始生成测试数据...")
     test_data = generate_test_data(start_timestamp, num_points)
     
-    # 模拟数据到达并计算，每处理一条数据后暂停等待用户输入
+    # 模拟数据到达并计算，非批处理模式下每处理一条数据后暂停等待用户输入
     if test_data:
         print(f"\n开始模拟数据流处理...")
-        print("每处理一条数据后将暂停，按回车继续...")
+        if not args.batch:
+            print("每处理一条数据后将暂停，按回车继续...")
         print(f"时间戳\t\t价格\t\tSMA")
         
         for i, (timestamp, value) in enumerate(test_data):
@@ -738,7 +822,8 @@ def main():
             print(f"{dt.strftime('%Y-%m-%d %H:%M:%S')}\t{value:.2f}\t{sma:.2f}")
             
             # 暂停等待用户输入
-            if i < len(test_data) - 1:  # 如果不是最后一个数据点，则等待用户输入
+            if not args.batch and i < len(test_data) - 1:  # 如果不是最后一个数据点，则等待用户输入
+                ma.flush_log()  # 暂停期间也能查看已写入的计算明细
                 input("按回车继续处理下一条数据...")
         
         # 关闭日志文件